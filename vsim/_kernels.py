@@ -0,0 +1,58 @@
+"""
+Compiled kernels for the vote allocation hot path.
+
+Numba is an optional dependency, when it is missing NUMBA_AVAILABLE is False
+and the kernels below run as (slow) plain python, so callers should dispatch
+to them only when it is True.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange, get_num_threads
+
+    NUMBA_AVAILABLE = True
+except ImportError:  # pragma: no cover
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+    def get_num_threads() -> int:
+        return 1
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _tally_nearest(
+    electorate: np.ndarray, candidates: np.ndarray, turnout: np.ndarray, n_chunks: int
+) -> np.ndarray:
+    n_voters, n_issues = electorate.shape
+    n_candidates = candidates.shape[0]
+    chunk_size = (n_voters + n_chunks - 1) // n_chunks
+
+    # one tally row per chunk so threads never write to the same counter
+    local_counts = np.zeros((n_chunks, n_candidates), dtype=np.int64)
+    for t in prange(n_chunks):
+        for i in range(t * chunk_size, min((t + 1) * chunk_size, n_voters)):
+            if not turnout[i]:
+                continue
+            best = 0
+            best_dist = 1e300
+            for c in range(n_candidates):
+                dist = 0.0
+                for k in range(n_issues):
+                    diff = electorate[i, k] - candidates[c, k]
+                    dist += diff * diff
+                if dist < best_dist:
+                    best_dist = dist
+                    best = c
+            local_counts[t, best] += 1
+
+    return local_counts.sum(axis=0)
+
+
+def tally_nearest(
+    electorate: np.ndarray, candidates: np.ndarray, turnout: np.ndarray
+) -> np.ndarray:
+    """Counts, per candidate, the voters who turned out and have it as nearest"""
+    return _tally_nearest(electorate, candidates, turnout, get_num_threads())
@@ -63,10 +63,13 @@ def setup_candidates(
     **kwargs
 ) -> np.ndarray:
     if scenario is not None:
-        return CANDIDATE_OPTIONS[scenario](
+        positions = CANDIDATE_OPTIONS[scenario](
             n_candidates=candidates, electorate=electorate, seed=seed
         )
     else:
-        return generate_default_candidates(
+        positions = generate_default_candidates(
             n_candidates=candidates, electorate=electorate, seed=seed
         )
+
+    # match the electorate precision, distance computations are memory bound
+    return np.asarray(positions, dtype=np.float32)
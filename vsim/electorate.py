@@ -3,30 +3,60 @@ Module for generating different kinds of electorate, represented
 as a (n_individuals, n_issues) matrix.
 """
 import numpy as np
-from functools import partial
+from functools import partial, lru_cache
 from sklearn.datasets import make_blobs
 from typing import Dict, Callable, Optional, Union
 
 
-def generate_polarized_electorate(
+@lru_cache(maxsize=16)
+def _make_blobs_cached(
     electorate_size: int,
     issues: int,
     clusters: int,
-    seed: Optional[int] = None,
-    cluster_std: Union[int, float] = 1,
+    seed: int,
+    cluster_std: Union[int, float],
+) -> np.ndarray:
+    electorate = _make_blobs(electorate_size, issues, clusters, seed, cluster_std)
+    electorate.setflags(write=False)  # shared between callers, copy to mutate
+    return electorate
+
+
+def _make_blobs(
+    electorate_size: int,
+    issues: int,
+    clusters: int,
+    seed: Optional[int],
+    cluster_std: Union[int, float],
 ) -> np.ndarray:
-    """Generates a voter base which is polarized, i.e. split in distinct clusters"""
-    return np.array(
+    return np.asarray(
         make_blobs(
             n_samples=electorate_size,
             n_features=issues,
             centers=clusters,
             random_state=seed,
             cluster_std=cluster_std,
-        )[0]
+        )[0],
+        dtype=np.float32,
     )
 
 
+def generate_polarized_electorate(
+    electorate_size: int,
+    issues: int,
+    clusters: int,
+    seed: Optional[int] = None,
+    cluster_std: Union[int, float] = 1,
+) -> np.ndarray:
+    """Generates a voter base which is polarized, i.e. split in distinct clusters
+
+    Seeded electorates are memoized and returned read-only, unseeded ones are
+    always freshly drawn.
+    """
+    if seed is None:
+        return _make_blobs(electorate_size, issues, clusters, seed, cluster_std)
+    return _make_blobs_cached(electorate_size, issues, clusters, seed, cluster_std)
+
+
 # shorthand for running certain parameter scenarios
 ELECTORATE_SCENARIOS: Dict[str, Callable] = {
     "centered": partial(generate_polarized_electorate, clusters=1),
@@ -36,8 +66,14 @@ ELECTORATE_SCENARIOS: Dict[str, Callable] = {
 
 
 def normalize(v: np.ndarray) -> np.ndarray:
-    """Needs to happen for our distance metric to be comparable across systems"""
-    return v / (np.linalg.norm(v) + 1e-16)
+    """Needs to happen for our distance metric to be comparable across systems
+
+    Scales so the average squared voter magnitude is one, independent of the
+    electorate size, while keeping the relative positions of voters intact.
+    """
+    v = np.ascontiguousarray(v, dtype=np.float32)
+    row_norms = np.linalg.norm(v, axis=1)
+    return v / (np.sqrt(np.mean(row_norms**2)) + 1e-16)
 
 
 def setup_electorate(
@@ -1,3 +1,4 @@
+import inspect
 import logging
 import pandas as pd
 import numpy as np
@@ -6,7 +7,13 @@ import matplotlib.pyplot as plt
 from dataclasses import dataclass
 from typing import Optional
 from vsim import common
-from vsim.voting_system import VotingSystem, ElectionResult
+from vsim.voting_system import (
+    DISTANCE_CHUNK_SIZE,
+    ElectionResult,
+    VotingSystem,
+    squared_distances,
+    squared_norms,
+)
 
 
 @dataclass
@@ -34,7 +41,7 @@ class VotingSimulator:
         scenario: Optional[str] = None,
     ):
         # misc settings
-        np.random.seed(seed)  # None means random without seed
+        self.rng = np.random.default_rng(seed)  # None means random without seed
         self.plot = plot
         self.log = log if log is not None else common.conf_logger(1, "vsim.log")
 
@@ -58,31 +65,54 @@ class VotingSimulator:
     def n_issues(self) -> int:
         return int(self.electorate.shape[1])
 
-    def calculate_fairness(self, result: ElectionResult) -> float:
-        """Fairness is defined as the inversed average distance to the winner(s)"""
-        avg_distances = []
-        for winner in result.winners:
-            avg_dist_to_winner = np.mean(
-                np.linalg.norm(self.candidates[winner] - self.electorate)
+    @staticmethod
+    def accepts_rng(system: VotingSystem) -> bool:
+        """Systems written against elect(electorate, candidates) take no rng"""
+        params = inspect.signature(system.elect).parameters.values()
+        return any(p.name == "rng" or p.kind == p.VAR_KEYWORD for p in params)
+
+    def average_distances(self) -> np.ndarray:
+        """Mean voter distance to every candidate"""
+        candidates_sq = squared_norms(self.candidates)
+        total_distances = np.zeros(self.n_candidates, dtype=np.float64)
+
+        # reduce block by block so the full distance matrix is never held
+        for start in range(0, self.n_voters, DISTANCE_CHUNK_SIZE):
+            chunk_d2 = squared_distances(
+                self.electorate[start : start + DISTANCE_CHUNK_SIZE],
+                self.candidates,
+                candidates_sq,
             )
-            avg_distances.append(avg_dist_to_winner)
+            # the matmul expansion can dip slightly below zero from rounding
+            np.maximum(chunk_d2, 0, out=chunk_d2)
+            np.sqrt(chunk_d2, out=chunk_d2)
+            total_distances += chunk_d2.sum(axis=0, dtype=np.float64)
+
+        return total_distances / self.n_voters
+
+    def calculate_fairness(
+        self, result: ElectionResult, avg_distances: Optional[np.ndarray] = None
+    ) -> float:
+        """Fairness is defined as the inversed average distance to the winner(s)"""
+        if avg_distances is None:
+            avg_distances = self.average_distances()
 
-        return 1 / float(np.mean(avg_distances))
+        winners = list(result.winners)
+        return 1 / float(avg_distances[winners].mean())
 
-    def calculate_weighted_fairness(self, result: ElectionResult) -> float:
+    def calculate_weighted_fairness(
+        self, result: ElectionResult, avg_distances: Optional[np.ndarray] = None
+    ) -> float:
         """Like above but weighted by election share outcome"""
-        avg_distances = {}
-        for candidate in result.cast_votes:
-            avg_dist_to_candidate = np.mean(
-                np.linalg.norm(self.candidates[candidate] - self.electorate)
-            )
-            avg_distances[candidate] = avg_dist_to_candidate
+        if avg_distances is None:
+            avg_distances = self.average_distances()
 
-        votes_total = sum(v for v in result.cast_votes.values())
-        avg_distances_weights = [dist / votes_total for dist in avg_distances]
-        avg_distances = np.array(list(avg_distances.values()))
+        candidates = list(result.cast_votes.keys())
+        votes = np.array(list(result.cast_votes.values()), dtype=float)
 
-        return 1 / float(np.average(avg_distances, weights=avg_distances_weights))
+        return 1 / float(
+            np.average(avg_distances[candidates], weights=votes / votes.sum())
+        )
 
     def display(self, result: ElectionResult, fairness: float):
         """Renders an election"""
@@ -91,13 +121,14 @@ class VotingSimulator:
         _, ax = plt.subplots()
 
         columns = [f"issue_{i}" for i in range(1, self.n_issues + 1)]
-        electorate_df = pd.DataFrame(self.electorate, columns=columns)
-        electorate_df["state"] = "voter"
 
-        # add candidates to same df to ease plotting
-        candidate_df = pd.DataFrame(self.candidates, columns=columns)
-        candidate_df["state"] = "candidate"
-        df = pd.concat([electorate_df, candidate_df])
+        # voters and candidates in one tagged df to ease plotting
+        df = pd.DataFrame(
+            np.vstack([self.electorate, self.candidates]), columns=columns, copy=False
+        )
+        df["state"] = np.repeat(
+            ["voter", "candidate"], [self.n_voters, self.n_candidates]
+        )
 
         sns.scatterplot(data=df, x="issue_1", y="issue_2", hue="state", ax=ax)
         ax.set_title(f"scenario={self.scenario}, {fairness=}")
@@ -106,11 +137,22 @@ class VotingSimulator:
 
     def run(self):
         self.log.debug("running voting sim")
-        result = self.voting_system.elect(self.electorate, self.candidates)
+        # each system picks its own tally path, only Majority keeps a full matrix
+        if self.accepts_rng(self.voting_system):
+            result = self.voting_system.elect(
+                self.electorate, self.candidates, rng=self.rng
+            )
+        else:
+            result = self.voting_system.elect(self.electorate, self.candidates)
+
+        # both fairness metrics derive from the same per candidate distances
+        avg_distances = self.average_distances()
         simulation_result = {
             "election_result": result,
-            "unweighted_fairness": self.calculate_fairness(result),
-            "weighted_fairness": self.calculate_weighted_fairness(result),
+            "unweighted_fairness": self.calculate_fairness(result, avg_distances),
+            "weighted_fairness": self.calculate_weighted_fairness(
+                result, avg_distances
+            ),
             "parameters": {},
         }
 
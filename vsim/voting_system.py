@@ -2,14 +2,15 @@
 This module contains strategy classes that implement different voting systems
 
 To add a new voting system, subclass the VotingSystem abstract base calss and be sure to implement the 'elect' method. Have a look at one of the current implementations for help!
+
+'elect' may take an optional rng keyword (a numpy Generator) to draw randomness from, the simulator passes its seeded one when present. Older subclasses implementing elect(electorate, candidates) keep working, they just draw from their own randomness.
 """
-import random
-import operator
 import numpy as np
 from abc import ABC, abstractmethod
-from typing import List, Set, Dict
+from typing import List, Set, Dict, Optional
 from dataclasses import dataclass
 from scipy.spatial import KDTree
+from vsim import _kernels
 
 
 @dataclass
@@ -18,29 +19,131 @@ class ElectionResult:
     cast_votes: dict
 
 
-def allocate_votes(
+# below this many candidates a dense distance matrix beats building a KDTree
+DENSE_CANDIDATE_LIMIT = 64
+
+# above this many voter-candidate pairs the compiled kernel beats numpy, but only
+# once it is loaded: compiling (~3.7s) or loading it from the on-disk cache
+# (~0.2s) costs far more than a dense numpy tally (~0.025s at 1.2M pairs), so a
+# one-shot election is slower with it and callers have to opt in via compiled
+KERNEL_WORK_THRESHOLD = 2**20
+
+# voters per block of the distance matrix, keeps each block cache sized
+DISTANCE_CHUNK_SIZE = 65536
+
+
+def squared_norms(v: np.ndarray) -> np.ndarray:
+    """Row-wise squared euclidean norms"""
+    return np.einsum("ij,ij->i", v, v)
+
+
+def squared_distances(
+    electorate: np.ndarray,
+    candidates: np.ndarray,
+    candidates_sq: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """(n_voters, n_candidates) squared euclidean distances via the matmul expansion"""
+    electorate_sq = squared_norms(electorate)
+    if candidates_sq is None:
+        candidates_sq = squared_norms(candidates)
+    return (
+        electorate_sq[:, None] + candidates_sq[None, :] - 2 * electorate @ candidates.T
+    )
+
+
+def count_votes(
     electorate: np.ndarray,
     candidates: np.ndarray,
     votes: int = 1,
     apathy_prob: float = 0.0,
-) -> Dict[int, int]:
-    """Allocates votes from electorate to candidates nearest neighbour(s)"""
+    rng: Optional[np.random.Generator] = None,
+    candidate_mask: Optional[np.ndarray] = None,
+    compiled: bool = False,
+    _d2: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Counts votes from electorate to candidates nearest neighbour(s), per candidate
+
+    Distances are derived DISTANCE_CHUNK_SIZE voters at a time. Apathy is drawn from rng, a fresh unseeded generator when not given. When a
+    boolean candidate_mask is given only candidates where it is True receive votes.
+    With compiled set, large single vote tallies use the numba kernel, worthwhile
+    only when the process runs many elections (see KERNEL_WORK_THRESHOLD).
+    """
     n_voters, _ = electorate.shape
     n_candidates, _ = candidates.shape
-    counted_votes = np.zeros(n_candidates)
+    d2 = _d2  # private, Majority reuses one full matrix across rounds
+
+    turnout = None
+    if apathy_prob > 0:
+        rng = rng if rng is not None else np.random.default_rng()
+        turnout = rng.random(n_voters) >= apathy_prob
+
+    # fused distance, argmin and tally without any (n_voters, n_candidates) buffer
+    unmasked = candidate_mask is None
+    use_kernel = compiled and _kernels.NUMBA_AVAILABLE and votes == 1
+    use_kernel = use_kernel and unmasked and d2 is None
+    if use_kernel and n_voters * n_candidates > KERNEL_WORK_THRESHOLD:
+        if turnout is None:
+            turnout = np.ones(n_voters, dtype=np.bool_)
+        return _kernels.tally_nearest(electorate, candidates, turnout)
+
+    use_dense = votes > 1 or n_candidates <= DENSE_CANDIDATE_LIMIT or not unmasked
+    if d2 is None and not use_dense:
+        # build tree for efficient NN lookup
+        kd_tree = KDTree(candidates)
+        _, closest_candidates = kd_tree.query(electorate, k=1)
+        if turnout is not None:
+            closest_candidates = closest_candidates[turnout]
+        return np.bincount(closest_candidates, minlength=n_candidates)
+
+    # tally block by block, when distances are derived here at most one chunk of
+    # them is in memory, a precomputed d2 (Majority) is only walked in blocks
+    candidates_sq = squared_norms(candidates) if d2 is None else None
+    counted_votes = np.zeros(n_candidates, dtype=np.int64)
+    for start in range(0, n_voters, DISTANCE_CHUNK_SIZE):
+        stop = start + DISTANCE_CHUNK_SIZE
+        if d2 is None:
+            chunk_d2 = squared_distances(
+                electorate[start:stop], candidates, candidates_sq
+            )
+        else:
+            chunk_d2 = d2[start:stop]
 
-    # build tree for efficient NN lookup
-    kd_tree = KDTree(candidates)
-    _, closest_candidates = kd_tree.query(electorate, k=votes)
+        # masked out candidates can never be among a voter's nearest
+        if not unmasked:
+            chunk_d2 = np.where(candidate_mask, chunk_d2, np.inf)
 
-    for i in range(n_voters):
-        voter_apathetic = np.random.rand() < apathy_prob
-        if voter_apathetic:
-            continue
+        # shape (chunk, votes), order among a voter's picks does not matter so
+        # several votes are a partial partition rather than a sort
+        if votes > 1:
+            closest = np.argpartition(chunk_d2, votes - 1, axis=1)[:, :votes]
         else:
-            counted_votes[closest_candidates[i]] += 1
+            closest = chunk_d2.argmin(axis=1)[:, None]
+
+        if turnout is not None:
+            closest = closest[turnout[start:stop]]
+        counted_votes += np.bincount(closest.ravel(), minlength=n_candidates)
+
+    return counted_votes
+
 
-    return dict(enumerate(counted_votes))
+def allocate_votes(
+    electorate: np.ndarray,
+    candidates: np.ndarray,
+    votes: int = 1,
+    apathy_prob: float = 0.0,
+    rng: Optional[np.random.Generator] = None,
+    compiled: bool = False,
+) -> Dict[int, int]:
+    """Allocates votes from electorate to candidates nearest neighbour(s)"""
+    counted_votes = count_votes(
+        electorate,
+        candidates,
+        votes,
+        apathy_prob,
+        rng=rng,
+        compiled=compiled,
+    )
+    return dict(enumerate(counted_votes.tolist()))
 
 
 class VotingSystem(ABC):
@@ -50,21 +153,40 @@ class VotingSystem(ABC):
         pass
 
     @abstractmethod
-    def elect(self, electorate: np.ndarray, candidates: np.ndarray) -> ElectionResult:
+    def elect(
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ) -> ElectionResult:
+        """Runs the election, drawing any randomness from rng (unseeded if omitted)"""
         pass
 
 
 class Plurality(VotingSystem):
-    def __init__(self, apathy_prob: float = 0.0, *args, **kwargs):
+    def __init__(
+        self, apathy_prob: float = 0.0, compiled: bool = False, *args, **kwargs
+    ):
         self.apathy_prob = apathy_prob
+        self.compiled = compiled
 
-    def elect(self, electorate: np.ndarray, candidates: np.ndarray) -> ElectionResult:
+    def elect(
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ) -> ElectionResult:
         """Elect a single winner by plurality (whoever gets the most votes)"""
-        electoral_vote_count = allocate_votes(
-            electorate, candidates, votes=1, apathy_prob=self.apathy_prob
+        counted_votes = count_votes(
+            electorate,
+            candidates,
+            votes=1,
+            apathy_prob=self.apathy_prob,
+            rng=rng,
+            compiled=self.compiled,
         )
-        winner_idx, _ = max(electoral_vote_count.items(), key=operator.itemgetter(1))
-        winners: Set[int] = {winner_idx}
+        winners: Set[int] = {int(counted_votes.argmax())}
+        electoral_vote_count = dict(enumerate(counted_votes.tolist()))
         result = ElectionResult(cast_votes=electoral_vote_count, winners=winners)
 
         return result
@@ -84,50 +206,56 @@ class Majority(VotingSystem):
         self.knockouts = round_knockouts
 
     def elect_rec(
-        self, electorate: np.ndarray, candidates: np.ndarray, prior_results=[]
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        d2: np.ndarray,
+        alive: np.ndarray,
+        prior_results=[],
     ) -> List[ElectionResult]:
         """Keeps knocking out candidates until one passes share threshold"""
 
         voters, _ = electorate.shape
-        electoral_vote_count = allocate_votes(electorate, candidates, votes=1)
+        counted_votes = count_votes(
+            electorate, candidates, votes=1, candidate_mask=alive, _d2=d2
+        )
+        live_idx = np.flatnonzero(alive)
+        electoral_vote_count = {int(c): int(counted_votes[c]) for c in live_idx}
 
         # check winner share and terminate if above threshold
-        winner_idx, _ = max(electoral_vote_count.items(), key=operator.itemgetter(1))
-        winner_share = electoral_vote_count[winner_idx] / voters
+        winner_idx = int(counted_votes.argmax())
+        winner_share = counted_votes[winner_idx] / voters
         above_threshold = winner_share > self.threshold
 
         result = ElectionResult({winner_idx}, cast_votes=electoral_vote_count)
         results = [*prior_results, result]
 
-        if above_threshold:
+        if above_threshold or live_idx.size == 1:
             return results
         else:
-            # cull k worst, TODO: fix so we don't throw away original indices here!
-            worst_performers = [
-                i
-                for i, _ in sorted(
-                    [(c, v) for c, v in electoral_vote_count.items()],
-                    key=operator.itemgetter(1),
-                    reverse=True,
-                )
+            # cull k worst, keeping at least two in the race while possible
+            knockouts_to_apply = max(min(self.knockouts, live_idx.size - 2), 1)
+            live_votes = counted_votes[live_idx]
+            knocked_out = live_idx[
+                np.argpartition(live_votes, knockouts_to_apply - 1)[:knockouts_to_apply]
             ]
+            next_round_alive = alive.copy()
+            next_round_alive[knocked_out] = False
 
-            # catch situation where we knock out more than remains
-            knockouts_to_apply = self.knockouts
-            candidates_remaining = len(electoral_vote_count.keys()) - knockouts_to_apply
-            while candidates_remaining < 2:
-                candidates_remaining = (
-                    len(electoral_vote_count.keys()) - knockouts_to_apply
-                )
-                knockouts_to_apply -= 1
+            return self.elect_rec(electorate, candidates, d2, next_round_alive, results)
 
-            knocked_out = worst_performers[:knockouts_to_apply]
-            next_round_candidates = np.delete(candidates, knocked_out, axis=0)
-
-            return self.elect_rec(electorate, next_round_candidates, results)
-
-    def elect(self, electorate: np.ndarray, candidates: np.ndarray) -> ElectionResult:
-        results: List[ElectionResult] = self.elect_rec(electorate, candidates)
+    def elect(
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ) -> ElectionResult:
+        # distances never change between rounds, only which candidates remain
+        d2 = squared_distances(electorate, candidates)
+        alive = np.ones(candidates.shape[0], dtype=bool)
+        results: List[ElectionResult] = self.elect_rec(
+            electorate, candidates, d2, alive
+        )
         return results[-1]
 
 
@@ -138,18 +266,24 @@ class ApprovalVoting(VotingSystem):
         self.apathy_prob = apathy_prob
         self.n_approvals_per_voter = n_approvals_per_voter
 
-    def elect(self, electorate: np.ndarray, candidates: np.ndarray) -> ElectionResult:
+    def elect(
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ) -> ElectionResult:
         n_candidates, _ = candidates.shape
         assert self.n_approvals_per_voter <= n_candidates, "more votes than candidates"
-        electoral_vote_count = allocate_votes(
+        counted_votes = count_votes(
             electorate,
             candidates,
             votes=self.n_approvals_per_voter,
             apathy_prob=self.apathy_prob,
+            rng=rng,
         )
 
-        winner_idx, _ = max(electoral_vote_count.items(), key=operator.itemgetter(1))
-        winners: Set[int] = {winner_idx}
+        winners: Set[int] = {int(counted_votes.argmax())}
+        electoral_vote_count = dict(enumerate(counted_votes.tolist()))
         result = ElectionResult(cast_votes=electoral_vote_count, winners=winners)
 
         return result
@@ -166,40 +300,50 @@ class ProportionalRepresentation(VotingSystem):
         apathy_prob: float = 0.0,
         seats_to_allocate: int = 349,
         min_share_threshold: float = 0.04,
+        compiled: bool = False,
         *args,
         **kwargs,
     ):
         self.seats: int = seats_to_allocate
         self.threshold: float = min_share_threshold
         self.apathy_prob: float = apathy_prob
+        self.compiled: bool = compiled
 
-    def elect(self, electorate: np.ndarray, candidates: np.ndarray) -> ElectionResult:
+    def elect(
+        self,
+        electorate: np.ndarray,
+        candidates: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ) -> ElectionResult:
         voters, _ = electorate.shape
-        electoral_vote_count = allocate_votes(electorate, candidates)
-        candidate_votes_under_threshold = {
-            c: v
-            for c, v in electoral_vote_count.items()
-            if (v / voters) < self.threshold
-        }
-
-        remaining_votes = voters - sum(candidate_votes_under_threshold.values())
-        allocated_seats = {
-            c: round((v / remaining_votes) * self.seats)
-            for c, v in electoral_vote_count.items()
-            if c not in candidate_votes_under_threshold
-        }
+        counted_votes = count_votes(
+            electorate,
+            candidates,
+            rng=rng,
+            compiled=self.compiled,
+        )
 
-        # handle off by one, or further underallocation
-        seats_allocated = sum(allocated_seats.values())
+        # only candidates at or above the threshold share the seats
+        passed = (counted_votes / voters) >= self.threshold
+        passed_idx = np.flatnonzero(passed)
+        remaining_votes = counted_votes[passed].sum()
+        allocated_seats = np.where(
+            passed, np.round((counted_votes / remaining_votes) * self.seats), 0
+        ).astype(np.int64)
 
-        while seats_allocated < self.seats:
-            cand = random.choice(list(allocated_seats.keys()))
-            allocated_seats[cand] += 1
-            seats_allocated += 1
+        # handle off by one, or further underallocation
+        deficit = self.seats - int(allocated_seats.sum())
+        if deficit > 0:
+            rng = rng if rng is not None else np.random.default_rng()
+            allocated_seats += np.bincount(
+                rng.choice(passed_idx, size=deficit),
+                minlength=allocated_seats.size,
+            )
 
         # loosely defined here, but just seen as candidate with highest seat count
-        winner = max(allocated_seats, key=lambda c: allocated_seats[c])
-        return ElectionResult(winners={winner}, cast_votes=allocated_seats)
+        winner = int(allocated_seats.argmax())
+        cast_votes = {int(c): int(allocated_seats[c]) for c in passed_idx}
+        return ElectionResult(winners={winner}, cast_votes=cast_votes)
 
 
 # constant of what systems are supported currently